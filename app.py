@@ -2,16 +2,31 @@
 QR Code Generator — Flask Web Application
 """
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from flask import Flask, render_template, request, jsonify, send_from_directory
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from urllib.parse import quote, unquote
 import base64
-from qr_engine import generate_qr
+from qr_engine import generate_qr, qr_filename, render_pixels
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 5 * 1024 * 1024  # 5 MB max upload
+app.config["MAX_LOGO_LENGTH"] = 1 * 1024 * 1024  # 1 MB max logo upload
 app.config["UPLOAD_FOLDER"] = os.path.join(os.path.dirname(__file__), "uploads")
 app.config["OUTPUT_FOLDER"] = os.path.join(os.path.dirname(__file__), "static", "generated")
+# Bitmap pixel counts above which renders go to the background. Measured at
+# border 4: styled modules and PDFs take ~20-60 ns/px and solid square PNGs
+# ~3 ns/px, while per-pixel gradients (square modules) take ~70-80 ns/px,
+# so both limits sit around 100 ms of rendering
+app.config["ASYNC_RENDER_MIN_PIXELS"] = 3_000_000
+app.config["ASYNC_GRADIENT_MIN_PIXELS"] = 1_000_000
+app.config["MAX_RENDER_PIXELS"] = 50_000_000  # ~7000 px square, ~150 MB as RGB
+app.config["FAILED_RENDER_TTL"] = 60  # seconds a failed render is kept for /status
 
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "svg", "webp"}
 
@@ -19,10 +34,40 @@ os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(app.config["OUTPUT_FOLDER"], exist_ok=True)
 
 
+# Background renders for slow requests, keyed by output filename
+render_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+pending_renders = {}
+failed_renders = {}  # filename -> (error message, time.monotonic() of the failure)
+pending_lock = threading.Lock()
+
+
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def is_slow_render(pixels: int, gradient: bool) -> bool:
+    """Whether a bitmap of this many pixels takes long enough to render in the background."""
+    if gradient:
+        return pixels > app.config["ASYNC_GRADIENT_MIN_PIXELS"]
+    return pixels > app.config["ASYNC_RENDER_MIN_PIXELS"]
+
+
+def _render_done(filename: str, future):
+    # Finished files are served from disk; failures are kept for /status to report
+    with pending_lock:
+        if pending_renders.get(filename) is future:
+            del pending_renders[filename]
+        if future.exception() is not None:
+            failed_renders[filename] = (str(future.exception()), time.monotonic())
+
+
+def _evict_failed_renders():
+    """Drop failures nobody polled for within FAILED_RENDER_TTL. Call with pending_lock held."""
+    cutoff = time.monotonic() - app.config["FAILED_RENDER_TTL"]
+    for filename in [f for f, (_, failed_at) in failed_renders.items() if failed_at < cutoff]:
+        del failed_renders[filename]
+
+
 # --------------- Routes ---------------
 
 @app.route("/")
@@ -67,7 +112,7 @@ def generate():
             if not os.path.exists(logo_path):
                 logo_path = None
 
-        filename = generate_qr(
+        options = dict(
             qr_type=qr_type,
             data=data,
             fg_color=fg_color,
@@ -80,23 +125,77 @@ def generate():
             output_format=output_format,
             size=size,
             border=border,
-            output_dir=app.config["OUTPUT_FOLDER"],
         )
+        output_dir = app.config["OUTPUT_FOLDER"]
+        filename = qr_filename(**options)
+
+        slow = False
+        if output_format != "svg":
+            pixels = render_pixels(qr_type, data, error_correction, logo_path, size, border)
+            if pixels > app.config["MAX_RENDER_PIXELS"]:
+                raise ValueError("QR code too large, lower the size or border")
+            # Only square modules are colored per pixel; styled ones get one color each
+            gradient = color_style != "solid" and bool(gradient_end) and module_style == "square"
+            slow = is_slow_render(pixels, gradient)
+
+        # A render already in flight for this file wins over everything else;
+        # files on disk are complete, since qr_engine renames them into place
+        future = None
+        with pending_lock:
+            _evict_failed_renders()
+            # A new request for a file that failed to render tries again
+            failed_renders.pop(filename, None)
+            running = pending_renders.get(filename)
+            if running is not None and not running.done():
+                status = "pending"
+            elif slow and not os.path.exists(os.path.join(output_dir, filename)):
+                # Render in the background; the client polls status_url until it is ready
+                future = render_executor.submit(generate_qr, output_dir=output_dir, **options)
+                pending_renders[filename] = future
+                status = "pending"
+            else:
+                status = "ready"
+        if future is not None:
+            future.add_done_callback(partial(_render_done, filename))
+        if status == "ready":
+            generate_qr(output_dir=output_dir, **options)
 
         file_url = f"/static/generated/{filename}"
         download_url = f"/download/{filename}"
 
         return jsonify({
             "success": True,
+            "status": status,
             "filename": filename,
             "file_url": file_url,
             "download_url": download_url,
+            "status_url": f"/status/{filename}",
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/status/<filename>")
+def render_status(filename):
+    """Report whether a QR code from /generate has finished rendering."""
+    with pending_lock:
+        future = pending_renders.get(filename)
+        failure = failed_renders.pop(filename, None)
+
+    # A finished future may still be listed until its done callback has run
+    if future is not None and not future.done():
+        return jsonify({"status": "pending"})
+    if future is not None and future.exception() is not None:
+        return jsonify({"status": "error", "error": str(future.exception())}), 500
+    if failure is not None:
+        return jsonify({"status": "error", "error": failure[0]}), 500
+
+    if os.path.isfile(os.path.join(app.config["OUTPUT_FOLDER"], filename)):
+        return jsonify({"status": "ready"})
+    return jsonify({"status": "error", "error": "Unknown QR code"}), 404
+
+
 @app.route("/download/<filename>")
 def download(filename):
     return send_from_directory(
@@ -106,6 +205,19 @@ def download(filename):
     )
 
 
+@app.route("/static/generated/<path:filename>")
+def generated_file(filename):
+    """Serve generated QR codes with long-lived caching — filenames are content hashes."""
+    resp = send_from_directory(
+        app.config["OUTPUT_FOLDER"],
+        filename,
+        conditional=True,
+    )
+    # Not "immutable": reloads still revalidate via ETag, which costs a 304
+    resp.headers["Cache-Control"] = "public, max-age=31536000"
+    return resp
+
+
 @app.route("/t")
 def show_text():
     """Display QR code text content — used for iOS compatibility."""
@@ -152,10 +264,18 @@ img{{max-width:90vmin;max-height:90vmin;image-rendering:pixelated;}}</style>
 
 @app.route("/upload-logo", methods=["POST"])
 def upload_logo():
-    if "logo" not in request.files:
+    # Per-request body limit: checked against Content-Length up front, and
+    # enforced while reading the stream when the header is missing (chunked)
+    request.max_content_length = app.config["MAX_LOGO_LENGTH"]
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Logo file too large (max 1 MB)"}), 413
+
+    if "logo" not in files:
         return jsonify({"error": "No file provided"}), 400
 
-    file = request.files["logo"]
+    file = files["logo"]
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
 
@@ -167,7 +287,8 @@ def upload_logo():
     import uuid
     unique_name = f"{uuid.uuid4().hex[:8]}_{filename}"
     filepath = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-    file.save(filepath)
+    with open(filepath, "wb") as f:
+        shutil.copyfileobj(file.stream, f, length=64 * 1024)
 
     return jsonify({
         "success": True,
@@ -5,12 +5,19 @@ then applies visual customization on top.
 """
 import qrcode
 import qrcode.image.svg
-from PIL import Image, ImageDraw, ImageColor
+import numpy as np
+from PIL import Image, ImageDraw, ImageColor, JpegImagePlugin
 from io import BytesIO
 import os
-import uuid
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas as pdf_canvas
 
 
@@ -123,6 +130,7 @@ FORMATTERS = {
 
 # --------------- Helpers ---------------
 
+@lru_cache(maxsize=256)
 def hex_to_rgb(hex_color: str) -> tuple:
     hex_color = hex_color.lstrip("#")
     if len(hex_color) == 3:
@@ -138,8 +146,149 @@ ERROR_LEVELS = {
 }
 
 
+# Part of every output filename hash. Bump it whenever a change to the
+# renderer alters the generated files, so stale cached files are not reused
+RENDER_VERSION = 3
+
+# zlib level for PNG output — QR codes compress well even at level 1, and
+# higher levels cost several times the CPU for a few KB
+PNG_COMPRESS_LEVEL = 1
+
+# Rows recolored per step by _apply_gradient, bounding its temporary buffers
+GRADIENT_BAND_ROWS = 128
+
+# Decoders tried when opening an uploaded logo
+LOGO_FORMATS = ("PNG", "JPEG", "GIF", "WEBP")
+
+
+# Module matrices (without border) keyed by (content, ec_level). Building one
+# runs the qrcode library's mask selection, which only depends on these two.
+MATRIX_CACHE_SIZE = 1000
+_MATRIX_CACHE = OrderedDict()
+_MATRIX_CACHE_LOCK = threading.Lock()
+
+
+def _get_matrix(content: str, ec_level: int) -> np.ndarray:
+    """
+    Return the QR module matrix for content as a read-only NxN uint8 array
+    (1 = dark module), reusing a cached one when possible.
+    """
+    key = (content, ec_level)
+    with _MATRIX_CACHE_LOCK:
+        matrix = _MATRIX_CACHE.get(key)
+        if matrix is not None:
+            _MATRIX_CACHE.move_to_end(key)
+            return matrix
+
+    qr = qrcode.QRCode(version=None, error_correction=ec_level, border=0)
+    qr.add_data(content)
+    qr.make(fit=True)
+    matrix = np.array(qr.get_matrix(), dtype=np.uint8)
+    # Shared between requests (and threads), so nobody may modify it
+    matrix.flags.writeable = False
+
+    with _MATRIX_CACHE_LOCK:
+        _MATRIX_CACHE[key] = matrix
+        if len(_MATRIX_CACHE) > MATRIX_CACHE_SIZE:
+            _MATRIX_CACHE.popitem(last=False)
+    return matrix
+
+
+def _encode(qr_type: str, data: dict, error_correction: str, logo_path: str) -> tuple:
+    """Format data for qr_type and resolve the error correction level to use."""
+    formatter = FORMATTERS.get(qr_type)
+    if not formatter:
+        raise ValueError(f"Unknown QR type: {qr_type}")
+    content = formatter(data)
+    if not content:
+        raise ValueError("No content to encode")
+
+    # Force HIGH error correction when logo is used
+    if logo_path:
+        error_correction = "H"
+
+    ec_level = ERROR_LEVELS.get(error_correction, qrcode.constants.ERROR_CORRECT_M)
+    return content, ec_level
+
+
+def _output_filename(
+    content, ec_level, fg_color, bg_color, gradient_end, color_style,
+    module_style, logo_path, output_format, size, border,
+) -> str:
+    """Name the file after a hash of everything that affects the output."""
+    params = (
+        RENDER_VERSION, content, fg_color, bg_color, gradient_end, color_style,
+        module_style, ec_level, logo_path, output_format, size, border,
+    )
+    file_id = hashlib.blake2b(repr(params).encode(), digest_size=16).hexdigest()
+    ext = output_format if output_format in ("svg", "pdf") else "png"
+    return f"qr_{file_id}.{ext}"
+
+
+def _write_atomic(filepath: str, write):
+    """
+    Call write(path) on a temp file next to filepath, then rename it into place.
+    The output filename doubles as the cache key, so it must never exist half-written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600 files
+        write(tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 # --------------- Main Generator ---------------
 
+def qr_filename(
+    qr_type: str,
+    data: dict,
+    fg_color: str = "#000000",
+    bg_color: str = "#FFFFFF",
+    gradient_end: str = None,
+    color_style: str = "solid",
+    module_style: str = "square",
+    error_correction: str = "M",
+    logo_path: str = None,
+    output_format: str = "png",
+    size: int = 10,
+    border: int = 4,
+) -> str:
+    """
+    Return the filename generate_qr will save these arguments to, without rendering.
+    Raises the same ValueError as generate_qr for invalid input.
+    """
+    content, ec_level = _encode(qr_type, data, error_correction, logo_path)
+    if output_format != "svg":
+        # Bitmaps parse the colors, so bad ones must fail here, not mid-render
+        hex_to_rgb(fg_color)
+        hex_to_rgb(bg_color)
+        if color_style != "solid" and gradient_end:
+            hex_to_rgb(gradient_end)
+    return _output_filename(
+        content, ec_level, fg_color, bg_color, gradient_end, color_style,
+        module_style, logo_path, output_format, size, border,
+    )
+
+
+def render_pixels(
+    qr_type: str,
+    data: dict,
+    error_correction: str = "M",
+    logo_path: str = None,
+    size: int = 10,
+    border: int = 4,
+) -> int:
+    """Return the pixel count of the PNG/PDF bitmap generate_qr renders for these arguments."""
+    content, ec_level = _encode(qr_type, data, error_correction, logo_path)
+    side = (len(_get_matrix(content, ec_level)) + 2 * border) * max(size, 10)
+    return side * side
+
+
 def generate_qr(
     qr_type: str,
     data: dict,
@@ -157,52 +306,60 @@ def generate_qr(
 ) -> str:
     """
     Generate a QR code and save it. Returns the filename.
-    Uses the STANDARD qrcode library rendering for maximum compatibility.
+    The module matrix comes from the standard qrcode library (for maximum
+    compatibility); PNG/PDF bitmaps are rendered locally from that matrix.
     """
-    formatter = FORMATTERS.get(qr_type)
-    if not formatter:
-        raise ValueError(f"Unknown QR type: {qr_type}")
-    content = formatter(data)
-    if not content:
-        raise ValueError("No content to encode")
-
-    # Force HIGH error correction when logo is used
-    if logo_path:
-        error_correction = "H"
-
-    ec_level = ERROR_LEVELS.get(error_correction, qrcode.constants.ERROR_CORRECT_M)
-    file_id = uuid.uuid4().hex[:12]
+    content, ec_level = _encode(qr_type, data, error_correction, logo_path)
     os.makedirs(output_dir, exist_ok=True)
 
+    # Repeated requests reuse the file rendered the first time
+    filename = _output_filename(
+        content, ec_level, fg_color, bg_color, gradient_end, color_style,
+        module_style, logo_path, output_format, size, border,
+    )
+    filepath = os.path.join(output_dir, filename)
+    if os.path.exists(filepath):
+        return filename
+
     # SVG format
     if output_format == "svg":
-        return _generate_svg(content, ec_level, size, border, file_id, output_dir)
+        _write_atomic(
+            filepath, lambda path: _generate_svg(content, ec_level, size, border, path)
+        )
+        return filename
 
-    # --- Use standard qrcode make_image (PROVEN to scan on all devices) ---
+    # --- Render from the standard qrcode matrix (PROVEN to scan on all devices) ---
     fg_rgb = hex_to_rgb(fg_color)
     bg_rgb = hex_to_rgb(bg_color)
 
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=ec_level,
-        box_size=max(size, 10),  # Minimum 10px per module
-        border=border,
-    )
-    qr.add_data(content)
-    qr.make(fit=True)
-
-    # Standard rendering — black on white (guaranteed scannable)
-    img = qr.make_image(fill_color=fg_rgb, back_color=bg_rgb)
-    img = img.convert("RGB")
+    box_size = max(size, 10)  # Minimum 10px per module
+    matrix = _get_matrix(content, ec_level)
 
-    # Apply gradient coloring if requested (post-processing)
+    grad_rgb = None
     if color_style != "solid" and gradient_end:
         grad_rgb = hex_to_rgb(gradient_end)
-        img = _apply_gradient(img, fg_rgb, bg_rgb, grad_rgb, color_style)
 
-    # Apply module style modifications (post-processing)
-    if module_style != "square":
-        img = _apply_module_style(img, fg_rgb, bg_rgb, module_style, max(size, 10))
+    if module_style == "square" and not grad_rgb and not logo_path and output_format == "png":
+        # Plain two-color PNG: stay paletted (1 byte per pixel) instead of RGB
+        img = Image.fromarray(_module_mask(matrix, "square", box_size, border))
+        img.putpalette([*bg_rgb, *fg_rgb])
+    elif module_style == "square" and grad_rgb:
+        # Square modules with a per-pixel gradient over the dark modules
+        mask = _module_mask(matrix, "square", box_size, border)
+        img = _apply_gradient(mask, fg_rgb, bg_rgb, grad_rgb, color_style)
+    elif module_style == "square":
+        # Standard square modules
+        img = _apply_module_style(matrix, fg_rgb, bg_rgb, "square", box_size, border)
+    else:
+        # Draw styled modules straight from the QR matrix, one color per module
+        colors = None
+        if grad_rgb:
+            colors = _module_colors(
+                len(matrix), box_size, border, fg_rgb, grad_rgb, color_style
+            )
+        img = _apply_module_style(
+            matrix, fg_rgb, bg_rgb, module_style, box_size, border, colors
+        )
 
     # Overlay logo
     if logo_path and os.path.exists(logo_path):
@@ -210,121 +367,182 @@ def generate_qr(
 
     # Save
     if output_format == "pdf":
-        filename = f"qr_{file_id}.pdf"
-        filepath = os.path.join(output_dir, filename)
-        _save_as_pdf(img, filepath)
+        _write_atomic(filepath, lambda path: _save_as_pdf(img, path))
+    elif img.mode == "P":
+        _write_atomic(
+            filepath,
+            lambda path: img.save(path, "PNG", compress_level=PNG_COMPRESS_LEVEL, bits=1),
+        )
     else:
-        filename = f"qr_{file_id}.png"
-        filepath = os.path.join(output_dir, filename)
-        img.save(filepath, "PNG")
+        _write_atomic(
+            filepath, lambda path: img.save(path, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+        )
 
     return filename
 
 
-def _apply_gradient(img, fg_rgb, bg_rgb, grad_rgb, color_style):
-    """Apply gradient coloring to an already-generated QR code by recoloring dark pixels."""
-    w, h = img.size
-    pixels = img.load()
-
-    for y in range(h):
-        for x in range(w):
-            r, g, b = pixels[x, y]
-            # Check if this pixel is a "dark" module (foreground)
-            brightness = (r + g + b) / 3
-            if brightness < 128:
-                # Calculate gradient factor
-                if color_style == "horizontal_gradient":
-                    t = x / max(w - 1, 1)
-                elif color_style == "vertical_gradient":
-                    t = y / max(h - 1, 1)
-                elif color_style == "radial_gradient":
-                    cx, cy = w / 2, h / 2
-                    dist = ((x - cx) ** 2 + (y - cy) ** 2) ** 0.5
-                    max_dist = (cx ** 2 + cy ** 2) ** 0.5
-                    t = min(dist / max_dist, 1.0)
-                elif color_style == "square_gradient":
-                    cx, cy = w / 2, h / 2
-                    t = max(abs(x - cx) / cx, abs(y - cy) / cy)
-                    t = min(t, 1.0)
-                else:
-                    t = 0
-
-                new_r = int(fg_rgb[0] + (grad_rgb[0] - fg_rgb[0]) * t)
-                new_g = int(fg_rgb[1] + (grad_rgb[1] - fg_rgb[1]) * t)
-                new_b = int(fg_rgb[2] + (grad_rgb[2] - fg_rgb[2]) * t)
-                pixels[x, y] = (new_r, new_g, new_b)
+def _generate_one(job: dict) -> str:
+    return generate_qr(**job)
+
+
+def generate_many(jobs: list, max_workers: int = None) -> list:
+    """
+    Generate many QR codes in parallel worker processes.
+    Each job is a dict of generate_qr keyword arguments; returns the filenames in order.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(_generate_one, jobs))
+
 
+def _gradient_factor(xx, yy, w, h, color_style):
+    """
+    Gradient factor (0..1) at pixel coordinates xx, yy of a w x h image.
+    xx and yy may be broadcastable (e.g. a row and a column), and the result
+    keeps their dtype, so float32 coordinates give float32 factors.
+    """
+    if color_style == "horizontal_gradient":
+        return xx / max(w - 1, 1)
+    if color_style == "vertical_gradient":
+        return yy / max(h - 1, 1)
+    if color_style == "radial_gradient":
+        cx, cy = w / 2, h / 2
+        max_dist = float(np.hypot(cx, cy))
+        return np.minimum(np.hypot(xx - cx, yy - cy) / max_dist, 1.0)
+    if color_style == "square_gradient":
+        cx, cy = w / 2, h / 2
+        return np.maximum(np.abs(xx - cx) / cx, np.abs(yy - cy) / cy).clip(0, 1)
+    return np.zeros(np.shape(xx))
+
+
+def _gradient_colors(t, fg_rgb, grad_rgb):
+    """Interpolate between fg_rgb and grad_rgb by the gradient factor t."""
+    fg = np.array(fg_rgb, dtype=t.dtype)
+    grad = np.array(grad_rgb, dtype=t.dtype)
+    return (fg + (grad - fg) * t[..., None]).astype(np.uint8)
+
+
+def _apply_gradient(mask, fg_rgb, bg_rgb, grad_rgb, color_style):
+    """
+    Render a QR code with gradient coloring: bg_rgb everywhere, and the
+    gradient from fg_rgb to grad_rgb on the dark-module pixels (non-zero in
+    mask, see _module_mask).
+    """
+    h, w = mask.shape
+    arr = np.full((h, w, 3), bg_rgb, dtype=np.uint8)
+
+    # Work through the image in bands of rows with float32 math, so the
+    # temporaries stay a fixed size however large the image is. Horizontal
+    # and vertical gradients only vary along one axis and stay 1-D per band.
+    xx = np.arange(w, dtype=np.float32)[None, :]
+    for y0 in range(0, h, GRADIENT_BAND_ROWS):
+        y1 = min(y0 + GRADIENT_BAND_ROWS, h)
+        yy = np.arange(y0, y1, dtype=np.float32)[:, None]
+        t = _gradient_factor(xx, yy, w, h, color_style)
+        colors = _gradient_colors(t, fg_rgb, grad_rgb)
+        np.copyto(arr[y0:y1], colors, where=mask[y0:y1, :, None].astype(bool))
+
+    return Image.fromarray(arr)
+
+
+def _module_colors(n, box_size, border, fg_rgb, grad_rgb, color_style):
+    """NxN table of gradient colors, sampled at the center pixel of each module."""
+    size = (n + border * 2) * box_size
+    centers = (np.arange(n) + border) * box_size + box_size // 2
+    yy, xx = np.meshgrid(centers, centers, indexing="ij")
+    return _gradient_colors(_gradient_factor(xx, yy, size, size, color_style), fg_rgb, grad_rgb)
+
+
+def _module_stamp(style, box_size):
+    """box_size x box_size 0/1 mask of the shape drawn for one dark module."""
+    stamp = Image.new("1", (box_size, box_size), 0)
+    draw = ImageDraw.Draw(stamp)
+    x0, y0 = 0, 0
+    x1, y1 = box_size, box_size
+
+    if style == "square":
+        draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=1)
+    elif style == "circle":
+        margin = max(1, box_size // 8)
+        draw.ellipse(
+            [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
+            fill=1,
+        )
+    elif style == "rounded":
+        margin = max(0, box_size // 12)
+        radius = max(2, box_size // 3)
+        draw.rounded_rectangle(
+            [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
+            radius=radius,
+            fill=1,
+        )
+    elif style == "gapped":
+        margin = max(1, box_size // 6)
+        draw.rectangle(
+            [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
+            fill=1,
+        )
+    elif style == "vertical_bars":
+        margin = max(1, box_size // 5)
+        draw.rectangle(
+            [x0 + margin, y0, x1 - margin - 1, y1 - 1],
+            fill=1,
+        )
+    elif style == "horizontal_bars":
+        margin = max(1, box_size // 5)
+        draw.rectangle(
+            [x0, y0 + margin, x1 - 1, y1 - margin - 1],
+            fill=1,
+        )
+
+    return np.array(stamp, dtype=np.uint8)
+
+
+def _module_mask(matrix, style, box_size, border=0):
+    """
+    Pixel-resolution uint8 mask of the QR matrix: 1 where a dark module's shape
+    is drawn, 0 for the quiet zone, light modules and the gaps between shapes.
+    """
+    if style == "square":
+        # Square modules fill their whole box, so upsampling the padded matrix
+        # is the entire render
+        dark = np.pad(np.asarray(matrix, dtype=np.uint8), border)
+        return np.kron(dark, np.ones((box_size, box_size), dtype=np.uint8))
+
+    n = len(matrix)
+    size = (n + border * 2) * box_size
+    mask = np.zeros((size, size), dtype=np.uint8)
+
+    # The module shape is drawn once, then tiled over every dark module
+    lo, hi = border * box_size, (border + n) * box_size
+    dark = np.asarray(matrix, dtype=np.uint8)
+    mask[lo:hi, lo:hi] = np.kron(dark, _module_stamp(style, box_size))
+    return mask
+
+
+def _apply_module_style(matrix, fg_rgb, bg_rgb, style, box_size, border=0, colors=None):
+    """
+    Draw square/rounded/circle/gapped modules directly from the QR matrix.
+    When a colors table is given, each module (r, c) is filled with colors[r][c].
+    """
+    mask = _module_mask(matrix, style, box_size, border)
+
+    if colors is None:
+        # Two colors only: use the mask as palette indices (0 = bg, 1 = fg)
+        img = Image.fromarray(mask)
+        img.putpalette([*bg_rgb, *fg_rgb])
+        return img.convert("RGB")
+
+    # Scale the color table up to one box_size x box_size block per module,
+    # then paste it through the mask onto a background canvas
+    n = len(matrix)
+    lo, hi = border * box_size, (border + n) * box_size
+    module_colors = Image.fromarray(colors).resize((hi - lo, hi - lo), Image.NEAREST)
+    img = Image.new("RGB", mask.shape[::-1], bg_rgb)
+    img.paste(module_colors, (lo, lo), Image.fromarray(mask[lo:hi, lo:hi].astype(bool)))
     return img
 
 
-def _apply_module_style(img, fg_rgb, bg_rgb, style, box_size):
-    """Apply rounded/circle/gapped styling by post-processing the standard QR code."""
-    w, h = img.size
-    pixels = img.load()
-
-    # Create a new image with background
-    new_img = Image.new("RGB", (w, h), bg_rgb)
-    draw = ImageDraw.Draw(new_img)
-
-    # Find module grid by scanning for transitions
-    # Each module is box_size x box_size pixels
-    # We need to figure out where the modules are
-    for y in range(0, h, box_size):
-        for x in range(0, w, box_size):
-            # Sample the center of this grid cell
-            cx = min(x + box_size // 2, w - 1)
-            cy = min(y + box_size // 2, h - 1)
-            r, g, b = pixels[cx, cy]
-            brightness = (r + g + b) / 3
-
-            if brightness < 128:
-                # This is a dark module — draw with style
-                color = pixels[cx, cy]
-                x0, y0 = x, y
-                x1, y1 = min(x + box_size, w), min(y + box_size, h)
-
-                if style == "circle":
-                    margin = max(1, box_size // 8)
-                    draw.ellipse(
-                        [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
-                        fill=color,
-                    )
-                elif style == "rounded":
-                    margin = max(0, box_size // 12)
-                    radius = max(2, box_size // 3)
-                    draw.rounded_rectangle(
-                        [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
-                        radius=radius,
-                        fill=color,
-                    )
-                elif style == "gapped":
-                    margin = max(1, box_size // 6)
-                    draw.rectangle(
-                        [x0 + margin, y0 + margin, x1 - margin - 1, y1 - margin - 1],
-                        fill=color,
-                    )
-                elif style == "vertical_bars":
-                    margin = max(1, box_size // 5)
-                    draw.rectangle(
-                        [x0 + margin, y0, x1 - margin - 1, y1 - 1],
-                        fill=color,
-                    )
-                elif style == "horizontal_bars":
-                    margin = max(1, box_size // 5)
-                    draw.rectangle(
-                        [x0, y0 + margin, x1 - 1, y1 - margin - 1],
-                        fill=color,
-                    )
-            else:
-                # Background module — keep as background
-                x0, y0 = x, y
-                x1, y1 = min(x + box_size, w), min(y + box_size, h)
-                draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=bg_rgb)
-
-    return new_img
-
-
-def _generate_svg(content, ec_level, size, border, file_id, output_dir):
+def _generate_svg(content, ec_level, size, border, filepath):
     factory = qrcode.image.svg.SvgPathImage
     qr = qrcode.QRCode(
         version=None,
@@ -335,19 +553,20 @@ def _generate_svg(content, ec_level, size, border, file_id, output_dir):
     qr.add_data(content)
     qr.make(fit=True)
     img = qr.make_image(image_factory=factory)
-
-    filename = f"qr_{file_id}.svg"
-    filepath = os.path.join(output_dir, filename)
     img.save(filepath)
-    return filename
 
 
 def _overlay_logo(qr_img: Image.Image, logo_path: str) -> Image.Image:
     """Overlay a logo at the center with white background."""
-    logo = Image.open(logo_path).convert("RGBA")
-
     qr_w, qr_h = qr_img.size
     max_logo_size = int(min(qr_w, qr_h) * 0.18)
+
+    logo = Image.open(logo_path, formats=LOGO_FORMATS)
+    # Let JPEGs decode at a reduced DCT scale instead of full resolution
+    # (camera photos with an MP header open as MPO, a JPEG subclass)
+    if isinstance(logo, JpegImagePlugin.JpegImageFile):
+        logo.draft("RGB", (max_logo_size * 2, max_logo_size * 2))
+    logo = logo.convert("RGBA")
     logo.thumbnail((max_logo_size, max_logo_size), Image.LANCZOS)
     logo_w, logo_h = logo.size
 
@@ -374,8 +593,6 @@ def _overlay_logo(qr_img: Image.Image, logo_path: str) -> Image.Image:
 
 def _save_as_pdf(img: Image.Image, filepath: str):
     img_rgb = img.convert("RGB")
-    temp_png = filepath.replace(".pdf", "_temp.png")
-    img_rgb.save(temp_png, "PNG")
 
     w, h = img_rgb.size
     max_dim = 150 * mm
@@ -387,8 +604,5 @@ def _save_as_pdf(img: Image.Image, filepath: str):
     page_w, page_h = A4
     x = (page_w - pdf_w) / 2
     y = (page_h - pdf_h) / 2
-    c.drawImage(temp_png, x, y, width=pdf_w, height=pdf_h)
+    c.drawImage(ImageReader(img_rgb), x, y, width=pdf_w, height=pdf_h)
     c.save()
-
-    if os.path.exists(temp_png):
-        os.remove(temp_png)
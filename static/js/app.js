@@ -288,6 +288,10 @@
             });
             const json = await res.json();
 
+            if (json.success && json.status === "pending") {
+                await waitForRender(json.status_url);
+            }
+
             if (json.success) {
                 lastGeneratedFilename = json.filename;
                 previewLoading.style.display = "none";
@@ -306,13 +310,14 @@
                     `;
                     previewResult.style.display = "block";
                 } else if (format === "svg") {
-                    // For SVG, display it in an img tag
-                    previewImg.src = json.file_url + "?t=" + Date.now();
+                    // For SVG, display it in an img tag (filenames are content
+                    // hashes, so the URL itself is cacheable — no cache-buster)
+                    previewImg.src = json.file_url;
                     previewResult.innerHTML = '';
                     previewResult.appendChild(previewImg);
                     previewResult.style.display = "block";
                 } else {
-                    previewImg.src = json.file_url + "?t=" + Date.now();
+                    previewImg.src = json.file_url;
                     previewResult.innerHTML = '';
                     previewResult.appendChild(previewImg);
                     previewResult.style.display = "block";
@@ -346,6 +351,27 @@
         }
     }
 
+    // Large renders finish in the background; poll at once, then back off
+    const RENDER_POLL_FIRST_DELAY = 50;  // ms, doubled after every poll
+    const RENDER_POLL_MAX_DELAY = 1000;  // ms
+    const RENDER_POLL_TIMEOUT = 30000;  // ms
+
+    async function waitForRender(statusUrl) {
+        const deadline = Date.now() + RENDER_POLL_TIMEOUT;
+        let delay = RENDER_POLL_FIRST_DELAY;
+        while (Date.now() < deadline) {
+            const res = await fetch(statusUrl);
+            const json = await res.json();
+            if (json.status === "ready") return;
+            if (json.status !== "pending") {
+                throw new Error(json.error || "Generation failed");
+            }
+            await new Promise((resolve) => setTimeout(resolve, delay));
+            delay = Math.min(delay * 2, RENDER_POLL_MAX_DELAY);
+        }
+        throw new Error("Timed out waiting for the QR code to render");
+    }
+
     // ---- Quick Format Downloads ----
     async function quickDownload(format) {
         if (!validate()) return;